@@ -2,11 +2,19 @@ from flask import Flask
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from flask_caching import Cache
+from flask_compress import Compress
+from flask_session import Session
+from celery import Celery, Task
 from .config import config
+from .utils.redis_client import init_redis
+from .utils.json_provider import OrjsonProvider
 import os
 
 db = SQLAlchemy()
 migrate = Migrate()
+cache = Cache()
+compress = Compress()
 
 
 def create_app(config_name=None):
@@ -16,11 +24,18 @@ def create_app(config_name=None):
     
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    app.json = OrjsonProvider(app)
     
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
+    cache.init_app(app)
+    compress.init_app(app)
     CORS(app, origins=[app.config['FRONTEND_URL']], supports_credentials=True)
+    init_redis(app)
+    app.config.setdefault('SESSION_REDIS', app.extensions['redis'])
+    Session(app)
+    celery_init_app(app)
     
     # Register blueprints
     from .routes import auth, repositories, pipelines, domains, settings
@@ -36,3 +51,21 @@ def create_app(config_name=None):
         return {'status': 'healthy'}, 200
     
     return app
+
+
+def celery_init_app(app):
+    """Create a Celery app whose tasks run inside the Flask app context"""
+    class FlaskTask(Task):
+        def __call__(self, *args, **kwargs):
+            with app.app_context():
+                return self.run(*args, **kwargs)
+    
+    celery_app = Celery(app.name, task_cls=FlaskTask, include=[f'{__name__}.tasks'])
+    celery_app.conf.update(
+        broker_url=app.config['CELERY_BROKER_URL'],
+        result_backend=app.config['CELERY_RESULT_BACKEND'],
+        task_ignore_result=True
+    )
+    celery_app.set_default()
+    app.extensions['celery'] = celery_app
+    return celery_app
@@ -10,6 +10,14 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///devops_tool.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool sized for concurrent pipeline tests
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 20)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 40)),
+        'pool_recycle': 1800,
+        'pool_pre_ping': False
+    }
+    
     # OAuth Configuration
     BITBUCKET_CLIENT_ID = os.getenv('BITBUCKET_CLIENT_ID')
     BITBUCKET_CLIENT_SECRET = os.getenv('BITBUCKET_CLIENT_SECRET')
@@ -29,6 +37,25 @@ class Config:
     # Redis
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
     
+    # Response cache for upstream repository listings
+    CACHE_TYPE = os.getenv('CACHE_TYPE', 'RedisCache')
+    CACHE_REDIS_URL = REDIS_URL
+    CACHE_DEFAULT_TIMEOUT = 30
+    
+    # Compress JSON bodies; SSE streams are left alone so events flush immediately
+    COMPRESS_MIMETYPES = ['application/json']
+    COMPRESS_ALGORITHM = ['br', 'gzip']
+    COMPRESS_LEVEL = 4
+    COMPRESS_BR_LEVEL = 4
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_STREAMS = False
+    
+    # Server-side sessions: the cookie only carries a signed session id
+    SESSION_TYPE = 'redis'
+    SESSION_USE_SIGNER = True
+    SESSION_PERMANENT = False
+    SESSION_KEY_PREFIX = 'session:'
+    
     # Celery
     CELERY_BROKER_URL = REDIS_URL
     CELERY_RESULT_BACKEND = REDIS_URL
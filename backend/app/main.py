@@ -2,6 +2,7 @@ from app import create_app, db
 import os
 
 app = create_app()
+celery_app = app.extensions['celery']
 
 # Initialize OAuth with app context
 with app.app_context():
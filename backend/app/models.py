@@ -30,6 +30,12 @@ class User(db.Model):
 class Repository(db.Model):
     """Repository model"""
     __tablename__ = 'repositories'
+    __table_args__ = (
+        # Also serves plain user_id lookups through its leading column
+        db.Index('ix_repositories_user_updated', 'user_id', 'updated_at'),
+        # One row per upstream repository, so a retried migration resumes instead of duplicating
+        db.UniqueConstraint('user_id', 'source', 'source_repo_id', name='uq_repositories_user_source_repo'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -43,7 +49,7 @@ class Repository(db.Model):
     bitbucket_repo_url = db.Column(db.String(500))
     bitbucket_workspace = db.Column(db.String(255))
     
-    status = db.Column(db.String(50), default='pending')  # pending, migrated, pipeline_generated, pipeline_testing, completed
+    status = db.Column(db.String(50), default='pending')  # pending, migrated, failed, pipeline_generated, pipeline_testing, completed
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -54,16 +60,20 @@ class Repository(db.Model):
 class Pipeline(db.Model):
     """Pipeline model"""
     __tablename__ = 'pipelines'
+    __table_args__ = (
+        db.Index('ix_pipelines_repository_version', 'repository_id', 'version', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     repository_id = db.Column(db.Integer, db.ForeignKey('repositories.id'), nullable=False)
     
     version = db.Column(db.Integer, default=1)
-    config = db.Column(db.Text, nullable=False)  # YAML content
+    # Large TEXT columns load only when accessed or undeferred as the 'content' group
+    config = db.deferred(db.Column(db.Text, nullable=False), group='content')  # YAML content
     status = db.Column(db.String(50), default='draft')  # draft, testing, failed, success
     
-    test_output = db.Column(db.Text)
-    error_message = db.Column(db.Text)
+    test_output = db.deferred(db.Column(db.Text), group='content')
+    error_message = db.deferred(db.Column(db.Text), group='content')
     
     deployment_server = db.Column(db.String(500))
     
@@ -78,9 +88,14 @@ class Pipeline(db.Model):
 class Domain(db.Model):
     """Domain model for managing root domain and subdomains"""
     __tablename__ = 'domains'
+    __table_args__ = (
+        # At most one root domain per user, enforced by the database
+        db.Index('ix_domains_user_root', 'user_id', unique=True,
+                 postgresql_where=db.text('is_root'), sqlite_where=db.text('is_root')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     
     name = db.Column(db.String(255), nullable=False)
     is_root = db.Column(db.Boolean, default=False)
@@ -1,7 +1,10 @@
-from flask import Blueprint, request, jsonify, session, redirect, current_app
+from flask import Blueprint, jsonify, session, redirect, current_app, url_for
 from authlib.integrations.flask_client import OAuth
 from ..models import User, db
-import secrets
+from .. import cache
+from .repositories import repos_cache_key, repos_error_key
+from ..utils.redis_client import get_redis
+from ..utils.user_cache import get_current_user, invalidate_user
 
 bp = Blueprint('auth', __name__)
 oauth = OAuth()
@@ -65,6 +68,12 @@ def bitbucket_callback():
         user.bitbucket_username = user_info['username']
         
         db.session.commit()
+        invalidate_user(user.id)
+        
+        # A new token may see different repositories
+        listing_path = url_for('repositories.list_bitbucket_repos')
+        cache.delete(repos_cache_key(user.id, listing_path))
+        get_redis().delete(repos_error_key(user.id, listing_path))
         
         # Store user in session
         session['user_id'] = user.id
@@ -113,6 +122,12 @@ def github_callback():
         user.github_username = user_info['login']
         
         db.session.commit()
+        invalidate_user(user.id)
+        
+        # A new token may see different repositories
+        listing_path = url_for('repositories.list_github_repos')
+        cache.delete(repos_cache_key(user.id, listing_path))
+        get_redis().delete(repos_error_key(user.id, listing_path))
         
         # Store user in session
         session['user_id'] = user.id
@@ -125,11 +140,7 @@ def github_callback():
 @bp.route('/status')
 def auth_status():
     """Check authentication status"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'authenticated': False}), 200
-    
-    user = User.query.get(user_id)
+    user = get_current_user()
     if not user:
         return jsonify({'authenticated': False}), 200
     
@@ -138,11 +149,11 @@ def auth_status():
         'user': {
             'id': user.id,
             'email': user.email,
-            'bitbucket_connected': bool(user.bitbucket_token),
+            'bitbucket_connected': user.bitbucket_connected,
             'bitbucket_username': user.bitbucket_username,
-            'github_connected': bool(user.github_token),
+            'github_connected': user.github_connected,
             'github_username': user.github_username,
-            'gemini_configured': bool(user.gemini_api_key)
+            'gemini_configured': user.gemini_configured
         }
     }), 200
 
@@ -1,15 +1,38 @@
-from flask import Blueprint, request, jsonify, session
-from ..models import User, Domain, db
+from flask import Blueprint, jsonify
+from sqlalchemy.exc import IntegrityError
+from typing import Annotated, Optional, Union
+import msgspec
+from ..models import Domain, db
+from ..utils.request_body import decode_json
+from ..utils.user_cache import get_current_user
 
 bp = Blueprint('domains', __name__)
 
 
-def get_current_user():
-    """Get current authenticated user"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
+class DomainCreatePayload(msgspec.Struct):
+    """Request body for creating a domain"""
+    name: Annotated[str, msgspec.Meta(min_length=1)]
+    is_root: bool = False
+    parent_domain_id: Optional[int] = None
+    description: Optional[str] = ''
+
+
+class DomainUpdatePayload(msgspec.Struct):
+    """Request body for updating a domain; omitted fields are left unchanged"""
+    name: Union[Annotated[str, msgspec.Meta(min_length=1)], msgspec.UnsetType] = msgspec.UNSET
+    description: Union[Optional[str], msgspec.UnsetType] = msgspec.UNSET
+    active: Union[bool, msgspec.UnsetType] = msgspec.UNSET
+
+
+_CREATE_DECODER = msgspec.json.Decoder(DomainCreatePayload, strict=False)
+_UPDATE_DECODER = msgspec.json.Decoder(DomainUpdatePayload, strict=False)
+
+
+def _violates_root_index(error):
+    """Whether an IntegrityError came from the one-root-domain-per-user index"""
+    # Postgres names the index; SQLite only reports the indexed column
+    message = str(error.orig)
+    return 'ix_domains_user_root' in message or 'domains.user_id' in message
 
 
 @bp.route('/', methods=['GET'])
@@ -19,18 +42,14 @@ def list_domains():
     if not user:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    domains = Domain.query.filter_by(user_id=user.id).all()
+    # Project only the listed columns; rows are never hydrated into Domain entities
+    domains = db.session.query(
+        Domain.id, Domain.name, Domain.is_root, Domain.parent_domain_id,
+        Domain.description, Domain.active, Domain.created_at
+    ).filter_by(user_id=user.id).all()
     
     return jsonify({
-        'domains': [{
-            'id': domain.id,
-            'name': domain.name,
-            'is_root': domain.is_root,
-            'parent_domain_id': domain.parent_domain_id,
-            'description': domain.description,
-            'active': domain.active,
-            'created_at': domain.created_at.isoformat() if domain.created_at else None
-        } for domain in domains]
+        'domains': [domain._asdict() for domain in domains]
     }), 200
 
 
@@ -41,14 +60,14 @@ def create_domain():
     if not user:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    data = request.json
-    name = data.get('name')
-    is_root = data.get('is_root', False)
-    parent_domain_id = data.get('parent_domain_id')
-    description = data.get('description', '')
-    
-    if not name:
-        return jsonify({'error': 'name is required'}), 400
+    try:
+        payload = decode_json(_CREATE_DECODER)
+    except msgspec.DecodeError as e:
+        return jsonify({'error': str(e)}), 400
+    name = payload.name
+    is_root = payload.is_root
+    parent_domain_id = payload.parent_domain_id
+    description = payload.description
     
     # Validate root domain logic
     if is_root:
@@ -86,6 +105,12 @@ def create_domain():
             }
         }), 201
         
+    except IntegrityError as e:
+        db.session.rollback()
+        # ix_domains_user_root backstops the check above against concurrent creates
+        if _violates_root_index(e):
+            return jsonify({'error': 'Root domain already exists'}), 400
+        return jsonify({'error': 'Domain conflicts with an existing record'}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -117,7 +142,7 @@ def get_domain(domain_id):
         'description': domain.description,
         'active': domain.active,
         'subdomains': subdomains,
-        'created_at': domain.created_at.isoformat() if domain.created_at else None
+        'created_at': domain.created_at
     }), 200
 
 
@@ -132,14 +157,17 @@ def update_domain(domain_id):
     if not domain:
         return jsonify({'error': 'Domain not found'}), 404
     
-    data = request.json
-    
-    if 'name' in data:
-        domain.name = data['name']
-    if 'description' in data:
-        domain.description = data['description']
-    if 'active' in data:
-        domain.active = data['active']
+    try:
+        payload = decode_json(_UPDATE_DECODER)
+    except msgspec.DecodeError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if payload.name is not msgspec.UNSET:
+        domain.name = payload.name
+    if payload.description is not msgspec.UNSET:
+        domain.description = payload.description
+    if payload.active is not msgspec.UNSET:
+        domain.active = payload.active
     
     try:
         db.session.commit()
@@ -1,43 +1,114 @@
-from flask import Blueprint, request, jsonify, session
-from ..models import User, Repository, Pipeline, db
+from flask import Blueprint, request, jsonify, session, current_app
+from sqlalchemy import func, insert, select, tuple_, update
+from sqlalchemy.orm import contains_eager, undefer_group
+from functools import lru_cache
+from typing import Optional
+import base64
+import msgspec
+import orjson
+from ..models import Repository, Pipeline, db
 from ..services.pipeline_generator import PipelineGenerator
 from ..services.pipeline_runner import PipelineRunner
 from ..services.gemini_service import GeminiService
-from ..services.bitbucket_service import BitbucketService
+from .repositories import get_owned_repository
+from ..tasks import PR_LOCK_SECONDS, create_pipeline_pr, pr_channel, pr_events_key, pr_lock_key
+from ..utils.etag import client_has, make_etag, not_modified, with_etag
+from ..utils.redis_client import get_redis
+from ..utils.request_body import decode_json
+from ..utils.user_cache import get_current_user, get_user_tokens
 
 bp = Blueprint('pipelines', __name__)
 
 
-def get_current_user():
-    """Get current authenticated user"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
+class GeneratePayload(msgspec.Struct):
+    """Request body for /generate"""
+    repository_id: int
+    deployment_server: Optional[str] = None
+
+
+class PipelinePayload(msgspec.Struct):
+    """Request body for endpoints acting on a single pipeline"""
+    pipeline_id: int
+
+
+# strict=False coerces string IDs in the body (e.g. from <select> values) to int
+_GENERATE_DECODER = msgspec.json.Decoder(GeneratePayload, strict=False)
+_PIPELINE_DECODER = msgspec.json.Decoder(PipelinePayload, strict=False)
+
+PR_TERMINAL_STATUSES = frozenset({'completed', 'failed'})
+SSE_KEEPALIVE_SECONDS = 15
+MAX_PAGE_SIZE = 100
+PIPELINE_BODY_TTL = 3600
+# Upper bound on a runner/Gemini call; the lock is released as soon as the call returns
+RUN_LOCK_SECONDS = 600
+
+# PipelineGenerator is stateless, so a single instance serves every request
+_GENERATOR = PipelineGenerator()
+
+
+@lru_cache(maxsize=None)
+def _get_runner():
+    """Share one runner (and its Docker client) across requests, created on first use"""
+    return PipelineRunner()
+
+
+def _get_owned_pipeline(pipeline_id, user_id, *options):
+    """Load a pipeline and its repository in one query, scoped to the owner"""
+    return db.session.execute(
+        select(Pipeline)
+        .join(Pipeline.repository)
+        .where(Pipeline.id == pipeline_id, Repository.user_id == user_id)
+        .options(contains_eager(Pipeline.repository), *options)
+    ).scalar_one_or_none()
+
+
+def _encode_cursor(pipeline):
+    """Build an opaque pagination cursor pointing after the given pipeline"""
+    return base64.urlsafe_b64encode(f'{pipeline.version}|{pipeline.id}'.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """Parse a pagination cursor into (version, id); raises ValueError if malformed"""
+    version, pipeline_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return int(version), int(pipeline_id)
+
+
+def _run_lock_key(action, pipeline_id):
+    """Redis key that lets only one test/iterate run per pipeline at a time"""
+    return f'pipeline:{action}:lock:{pipeline_id}'
+
+
+def _sse(event):
+    """Format an event dict as a server-sent event frame"""
+    return f"id: {event['id']}\ndata: {orjson.dumps(event).decode()}\n\n"
+
+
+def require_user_id():
+    """Get the authenticated user's id from the session without a DB lookup"""
+    return session.get('user_id')
 
 
 @bp.route('/generate', methods=['POST'])
 def generate_pipeline():
     """Generate a pipeline configuration for a repository"""
-    user = get_current_user()
-    if not user:
+    user_id = require_user_id()
+    if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    data = request.json
-    repo_id = data.get('repository_id')
-    deployment_server = data.get('deployment_server')
-    
-    if not repo_id:
-        return jsonify({'error': 'repository_id is required'}), 400
+    try:
+        payload = decode_json(_GENERATE_DECODER)
+    except msgspec.DecodeError as e:
+        return jsonify({'error': str(e)}), 400
+    repo_id = payload.repository_id
+    deployment_server = payload.deployment_server
     
-    repository = Repository.query.filter_by(id=repo_id, user_id=user.id).first()
+    repository = get_owned_repository(repo_id, user_id)
     if not repository:
         return jsonify({'error': 'Repository not found'}), 404
     
     try:
         # Generate initial pipeline configuration
-        generator = PipelineGenerator()
-        pipeline_config = generator.generate_deployment_pipeline(
+        pipeline_config = _GENERATOR.generate_deployment_pipeline(
             repo_name=repository.name,
             deployment_server=deployment_server
         )
@@ -60,7 +131,7 @@ def generate_pipeline():
             'pipeline': {
                 'id': pipeline.id,
                 'version': pipeline.version,
-                'config': pipeline.config,
+                'config': pipeline_config,
                 'status': pipeline.status
             }
         }), 201
@@ -73,37 +144,57 @@ def generate_pipeline():
 @bp.route('/test', methods=['POST'])
 def test_pipeline():
     """Test a pipeline configuration"""
-    user = get_current_user()
-    if not user:
+    user_id = require_user_id()
+    if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    data = request.json
-    pipeline_id = data.get('pipeline_id')
-    
-    if not pipeline_id:
-        return jsonify({'error': 'pipeline_id is required'}), 400
+    try:
+        pipeline_id = decode_json(_PIPELINE_DECODER).pipeline_id
+    except msgspec.DecodeError as e:
+        return jsonify({'error': str(e)}), 400
     
-    pipeline = Pipeline.query.get(pipeline_id)
-    if not pipeline or pipeline.repository.user_id != user.id:
+    pipeline = _get_owned_pipeline(pipeline_id, user_id, undefer_group('content'))
+    if not pipeline:
         return jsonify({'error': 'Pipeline not found'}), 404
     
+    # Snapshot what the runner needs and release the DB connection while it runs
+    pipeline_id = pipeline.id
+    pipeline_config = pipeline.config
+    repository_url = pipeline.repository.bitbucket_repo_url
+    db.session.close()
+    
+    redis_client = get_redis()
+    lock_key = _run_lock_key('test', pipeline_id)
+    if not redis_client.set(lock_key, b'1', nx=True, ex=RUN_LOCK_SECONDS):
+        return jsonify({'error': 'Pipeline test already in progress'}), 409
+    
     try:
         # Run pipeline in self-hosted runner
-        runner = PipelineRunner()
-        result = runner.run_pipeline(
-            pipeline_config=pipeline.config,
-            repository_url=pipeline.repository.bitbucket_repo_url
+        result = _get_runner().run_pipeline(
+            pipeline_config=pipeline_config,
+            repository_url=repository_url
         )
         
-        pipeline.status = 'success' if result['success'] else 'failed'
-        pipeline.test_output = result['output']
-        pipeline.error_message = result.get('error')
-        
-        if result['success']:
-            pipeline.repository.status = 'completed'
-        else:
-            pipeline.repository.status = 'pipeline_testing'
+        # Write results back without reloading; the WHERE re-checks ownership
+        repository_id = db.session.execute(
+            update(Pipeline)
+            .where(Pipeline.id == pipeline_id, Pipeline.repository.has(user_id=user_id))
+            .values(
+                status='success' if result['success'] else 'failed',
+                test_output=result['output'],
+                error_message=result.get('error')
+            )
+            .returning(Pipeline.repository_id)
+        ).scalar_one_or_none()
+        if repository_id is None:
+            db.session.rollback()
+            return jsonify({'error': 'Pipeline not found'}), 404
         
+        db.session.execute(
+            update(Repository)
+            .where(Repository.id == repository_id)
+            .values(status='completed' if result['success'] else 'pipeline_testing')
+        )
         db.session.commit()
         
         return jsonify({
@@ -118,6 +209,8 @@ def test_pipeline():
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+    finally:
+        redis_client.delete(lock_key)
 
 
 @bp.route('/iterate', methods=['POST'])
@@ -127,153 +220,286 @@ def iterate_pipeline():
     if not user:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    if not user.gemini_api_key:
+    if not user.gemini_configured:
         return jsonify({'error': 'Gemini API key not configured'}), 400
     
-    data = request.json
-    pipeline_id = data.get('pipeline_id')
-    
-    if not pipeline_id:
-        return jsonify({'error': 'pipeline_id is required'}), 400
+    try:
+        pipeline_id = decode_json(_PIPELINE_DECODER).pipeline_id
+    except msgspec.DecodeError as e:
+        return jsonify({'error': str(e)}), 400
     
-    pipeline = Pipeline.query.get(pipeline_id)
-    if not pipeline or pipeline.repository.user_id != user.id:
+    pipeline = _get_owned_pipeline(pipeline_id, user.id, undefer_group('content'))
+    if not pipeline:
         return jsonify({'error': 'Pipeline not found'}), 404
     
     if pipeline.status != 'failed':
         return jsonify({'error': 'Pipeline must be in failed state to iterate'}), 400
     
+    redis_client = get_redis()
+    lock_key = _run_lock_key('iterate', pipeline.id)
+    if not redis_client.set(lock_key, b'1', nx=True, ex=RUN_LOCK_SECONDS):
+        return jsonify({'error': 'Pipeline iteration already in progress'}), 409
+    
     try:
         # Use Gemini to analyze and fix the pipeline
-        gemini_service = GeminiService(user.gemini_api_key)
+        gemini_service = GeminiService(get_user_tokens(user.id).gemini_api_key)
         new_config = gemini_service.fix_pipeline(
             current_config=pipeline.config,
             error_output=pipeline.test_output,
             error_message=pipeline.error_message
         )
         
-        # Create new pipeline version
-        new_version = pipeline.version + 1
-        new_pipeline = Pipeline(
-            repository_id=pipeline.repository_id,
-            version=new_version,
-            config=new_config,
-            status='draft',
-            deployment_server=pipeline.deployment_server
-        )
-        db.session.add(new_pipeline)
+        # Create new pipeline version with a single INSERT ... RETURNING
+        new_pipeline = {
+            'repository_id': pipeline.repository_id,
+            'version': pipeline.version + 1,
+            'config': new_config,
+            'status': 'draft',
+            'deployment_server': pipeline.deployment_server
+        }
+        new_pipeline_id = db.session.execute(
+            insert(Pipeline).values(**new_pipeline).returning(Pipeline.id)
+        ).scalar_one()
         db.session.commit()
         
         return jsonify({
             'message': 'New pipeline version created',
             'pipeline': {
-                'id': new_pipeline.id,
-                'version': new_pipeline.version,
-                'config': new_pipeline.config,
-                'status': new_pipeline.status
+                'id': new_pipeline_id,
+                'version': new_pipeline['version'],
+                'config': new_pipeline['config'],
+                'status': new_pipeline['status']
             }
         }), 201
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+    finally:
+        redis_client.delete(lock_key)
 
 
 @bp.route('/create-pr', methods=['POST'])
 def create_pull_request():
     """Create a pull request with the working pipeline configuration"""
     user = get_current_user()
-    if not user or not user.bitbucket_token:
+    if not user or not user.bitbucket_connected:
         return jsonify({'error': 'Not authenticated with Bitbucket'}), 401
     
-    data = request.json
-    pipeline_id = data.get('pipeline_id')
-    
-    if not pipeline_id:
-        return jsonify({'error': 'pipeline_id is required'}), 400
+    try:
+        pipeline_id = decode_json(_PIPELINE_DECODER).pipeline_id
+    except msgspec.DecodeError as e:
+        return jsonify({'error': str(e)}), 400
     
-    pipeline = Pipeline.query.get(pipeline_id)
-    if not pipeline or pipeline.repository.user_id != user.id:
+    pipeline = _get_owned_pipeline(pipeline_id, user.id)
+    if not pipeline:
         return jsonify({'error': 'Pipeline not found'}), 404
     
     if pipeline.status != 'success':
         return jsonify({'error': 'Pipeline must be successful before creating PR'}), 400
     
-    if pipeline.pr_created:
+    # Coalesce double-clicks before touching the database or Bitbucket
+    redis_client = get_redis()
+    lock_key = pr_lock_key(pipeline.id)
+    if not redis_client.set(lock_key, b'1', nx=True, ex=PR_LOCK_SECONDS):
+        return jsonify({'error': 'PR creation in progress'}), 409
+    
+    if pipeline.pr_url:
+        redis_client.delete(lock_key)
         return jsonify({'error': 'PR already created for this pipeline', 'pr_url': pipeline.pr_url}), 400
     
+    # Atomically claim the pipeline so concurrent requests cannot open two PRs. Holding
+    # the lock means no worker is alive for it, so a claim still without a pr_url was
+    # left by a lost task and is taken over
+    claimed = Pipeline.query.filter_by(id=pipeline.id, pr_url=None).update(
+        {'pr_created': True}, synchronize_session=False
+    )
+    db.session.commit()
+    if not claimed:
+        redis_client.delete(lock_key)
+        return jsonify({'error': 'PR already created for this pipeline'}), 400
+    
     try:
-        bitbucket_service = BitbucketService(user.bitbucket_token)
-        
-        # Create branch and commit pipeline configuration
-        pr_url = bitbucket_service.create_pipeline_pr(
-            workspace=pipeline.repository.bitbucket_workspace,
-            repo_slug=pipeline.repository.name,
-            pipeline_config=pipeline.config,
-            branch_name=f'add-pipeline-v{pipeline.version}'
-        )
-        
-        pipeline.pr_created = True
-        pipeline.pr_url = pr_url
-        db.session.commit()
+        # Start a fresh progress log, then hand the Bitbucket calls to a worker
+        # (the worker renews the lock when it starts and releases it once it finishes)
+        redis_client.delete(pr_events_key(pipeline.id))
+        task = create_pipeline_pr.apply_async((pipeline.id,), expires=PR_LOCK_SECONDS)
         
         return jsonify({
-            'message': 'Pull request created successfully',
-            'pr_url': pr_url
-        }), 201
+            'message': 'Pull request creation started',
+            'job_id': task.id
+        }), 202
         
     except Exception as e:
         db.session.rollback()
+        # Release the claim so the PR can be retried
+        Pipeline.query.filter_by(id=pipeline.id).update({'pr_created': False}, synchronize_session=False)
+        db.session.commit()
+        redis_client.delete(lock_key)
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/<int:pipeline_id>/pr/stream', methods=['GET'])
+def stream_pull_request(pipeline_id):
+    """Stream pull request creation progress as server-sent events"""
+    user_id = require_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    pipeline = _get_owned_pipeline(pipeline_id, user_id)
+    if not pipeline:
+        return jsonify({'error': 'Pipeline not found'}), 404
+    
+    redis_client = get_redis()
+    last_event_id = request.headers.get('Last-Event-ID', type=int) or 0
+    
+    # Subscribe before reading the backlog so no event is missed in between
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(pr_channel(pipeline_id))
+    backlog = redis_client.lrange(pr_events_key(pipeline_id), last_event_id, -1)
+    
+    if not backlog and not last_event_id:
+        if not pipeline.pr_created:
+            pubsub.close()
+            return jsonify({'error': 'No pull request in progress for this pipeline'}), 404
+        if pipeline.pr_url:
+            # Created before progress was recorded, or the log has expired
+            pubsub.close()
+            backlog = [orjson.dumps({'status': 'completed', 'pr_url': pipeline.pr_url})]
+    
+    db.session.close()
+    
+    def generate():
+        sent_id = last_event_id
+        try:
+            for raw in backlog:
+                sent_id += 1
+                event = {**orjson.loads(raw), 'id': sent_id}
+                yield _sse(event)
+                if event['status'] in PR_TERMINAL_STATUSES:
+                    return
+            
+            while True:
+                message = pubsub.get_message(timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    if redis_client.exists(pr_lock_key(pipeline_id)):
+                        yield ': keepalive\n\n'
+                        continue
+                    # The worker finished, or the task expired in the queue before one took
+                    # it; replay anything published meanwhile, then end the stream either way
+                    for raw in redis_client.lrange(pr_events_key(pipeline_id), sent_id, -1):
+                        sent_id += 1
+                        event = {**orjson.loads(raw), 'id': sent_id}
+                        yield _sse(event)
+                        if event['status'] in PR_TERMINAL_STATUSES:
+                            return
+                    yield _sse({'status': 'failed', 'error': 'Pull request creation did not report a result', 'id': sent_id + 1})
+                    return
+                event = orjson.loads(message['data'])
+                if event['id'] <= sent_id:
+                    continue
+                sent_id = event['id']
+                yield _sse(event)
+                if event['status'] in PR_TERMINAL_STATUSES:
+                    return
+        finally:
+            pubsub.close()
+    
+    return current_app.response_class(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @bp.route('/repository/<int:repo_id>', methods=['GET'])
 def list_pipelines(repo_id):
     """List all pipelines for a repository"""
-    user = get_current_user()
-    if not user:
+    user_id = require_user_id()
+    if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    repository = Repository.query.filter_by(id=repo_id, user_id=user.id).first()
+    repository = get_owned_repository(repo_id, user_id)
     if not repository:
         return jsonify({'error': 'Repository not found'}), 404
     
-    pipelines = Pipeline.query.filter_by(repository_id=repo_id).order_by(Pipeline.version.desc()).all()
+    # Any insert, update or delete changes the newest updated_at or the row count
+    last_updated, count = db.session.query(
+        func.max(Pipeline.updated_at), func.count(Pipeline.id)
+    ).filter_by(repository_id=repo_id).one()
+    etag = make_etag(repo_id, last_updated, count, request.args.get('cursor'), request.args.get('limit'))
+    if client_has(etag):
+        return not_modified(etag)
+    
+    # Project only the summary columns so config/test_output are never loaded
+    query = db.session.query(
+        Pipeline.id, Pipeline.version, Pipeline.status, Pipeline.deployment_server,
+        Pipeline.pr_created, Pipeline.pr_url, Pipeline.created_at
+    ).filter_by(repository_id=repo_id).order_by(Pipeline.version.desc(), Pipeline.id.desc())
+    
+    # Optional keyset pagination: ?limit=N&cursor=<next_cursor from the previous page>
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            version, last_id = _decode_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(tuple_(Pipeline.version, Pipeline.id) < (version, last_id))
     
-    return jsonify({
-        'pipelines': [{
-            'id': p.id,
-            'version': p.version,
-            'status': p.status,
-            'deployment_server': p.deployment_server,
-            'pr_created': p.pr_created,
-            'pr_url': p.pr_url,
-            'created_at': p.created_at.isoformat() if p.created_at else None
-        } for p in pipelines]
-    }), 200
+    limit = request.args.get('limit', type=int)
+    next_cursor = None
+    if limit:
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        pipelines = query.limit(limit + 1).all()
+        if len(pipelines) > limit:
+            pipelines = pipelines[:limit]
+            next_cursor = _encode_cursor(pipelines[-1])
+    else:
+        pipelines = query.all()
+    
+    response = jsonify({
+        'next_cursor': next_cursor,
+        # Rows carry exactly the projected summary columns, keyed by column name
+        'pipelines': [p._asdict() for p in pipelines]
+    })
+    return with_etag(response, etag), 200
 
 
 @bp.route('/<int:pipeline_id>', methods=['GET'])
 def get_pipeline(pipeline_id):
     """Get pipeline details"""
-    user = get_current_user()
-    if not user:
+    user_id = require_user_id()
+    if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    pipeline = Pipeline.query.get(pipeline_id)
-    if not pipeline or pipeline.repository.user_id != user.id:
+    pipeline = _get_owned_pipeline(pipeline_id, user_id)
+    if not pipeline:
         return jsonify({'error': 'Pipeline not found'}), 404
     
-    return jsonify({
-        'id': pipeline.id,
-        'version': pipeline.version,
-        'config': pipeline.config,
-        'status': pipeline.status,
-        'test_output': pipeline.test_output,
-        'error_message': pipeline.error_message,
-        'deployment_server': pipeline.deployment_server,
-        'pr_created': pipeline.pr_created,
-        'pr_url': pipeline.pr_url,
-        'created_at': pipeline.created_at.isoformat() if pipeline.created_at else None,
-        'updated_at': pipeline.updated_at.isoformat() if pipeline.updated_at else None
-    }), 200
+    etag = make_etag(pipeline.id, pipeline.updated_at)
+    if client_has(etag):
+        return not_modified(etag)
+    
+    # The body is versioned by updated_at, so a hit skips loading the deferred
+    # content columns and re-encoding them; stale versions simply expire
+    redis_client = get_redis()
+    body_key = f'pipeline:{pipeline.id}:{pipeline.updated_at.isoformat()}'
+    body = redis_client.get(body_key)
+    if body is None:
+        body = current_app.json.dumps({
+            'id': pipeline.id,
+            'version': pipeline.version,
+            'config': pipeline.config,
+            'status': pipeline.status,
+            'test_output': pipeline.test_output,
+            'error_message': pipeline.error_message,
+            'deployment_server': pipeline.deployment_server,
+            'pr_created': pipeline.pr_created,
+            'pr_url': pipeline.pr_url,
+            'created_at': pipeline.created_at,
+            'updated_at': pipeline.updated_at
+        })
+        redis_client.setex(body_key, PIPELINE_BODY_TTL, body)
+    
+    response = current_app.response_class(body, mimetype='application/json')
+    return with_etag(response, etag), 200
@@ -1,47 +1,135 @@
-from flask import Blueprint, request, jsonify, session
-from ..models import User, Repository, db
+from flask import Blueprint, request, jsonify, session, url_for
+from sqlalchemy import bindparam, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from typing import Annotated, Optional
+import base64
+import msgspec
+from ..models import Repository, db
+from .. import cache
 from ..services.github_service import GitHubService
 from ..services.bitbucket_service import BitbucketService
+from ..tasks import mirror_repository
+from ..utils.etag import client_has, make_etag, not_modified, with_etag
+from ..utils.redis_client import get_redis
+from ..utils.request_body import decode_json
+from ..utils.user_cache import get_current_user, get_user_tokens
 
 bp = Blueprint('repositories', __name__)
 
 
-def get_current_user():
-    """Get current authenticated user"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
+class MigratePayload(msgspec.Struct):
+    """Request body for /migrate"""
+    repo_name: Annotated[str, msgspec.Meta(min_length=1)]
+    source: str = 'github'
+    workspace: Optional[str] = None
+
+
+_MIGRATE_DECODER = msgspec.json.Decoder(MigratePayload, strict=False)
+
+# How long a failed upstream listing is replayed instead of retried
+UPSTREAM_ERROR_TTL = 10
+MAX_PAGE_SIZE = 100
+# A mirror still 'pending' after this long lost its worker and may be resumed
+MIRROR_STALE_AFTER = timedelta(hours=1)
+
+
+# Built once so every owner-scoped lookup reuses the same cached compiled SQL
+_OWNED_REPOSITORY = select(Repository).where(
+    Repository.id == bindparam('repo_id'), Repository.user_id == bindparam('user_id')
+)
+
+
+def get_owned_repository(repo_id, user_id):
+    """Load a repository scoped to its owner"""
+    return db.session.execute(
+        _OWNED_REPOSITORY, {'repo_id': repo_id, 'user_id': user_id}
+    ).scalar_one_or_none()
+
+
+def _encode_cursor(repository):
+    """Build an opaque pagination cursor pointing after the given repository"""
+    return base64.urlsafe_b64encode(f'{repository.updated_at.isoformat()}|{repository.id}'.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """Parse a pagination cursor into (updated_at, id); raises ValueError if malformed"""
+    updated_at, repo_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(updated_at), int(repo_id)
+
+
+def repos_cache_key(user_id, path):
+    """Cache key for a user's upstream repository listing"""
+    return f'repos:{user_id}:{path}'
+
+
+def _listing_cache_key():
+    """Cache key for the listing being requested"""
+    return repos_cache_key(session.get('user_id'), request.path)
+
+
+def repos_error_key(user_id, path):
+    """Redis key for a user's recently failed upstream repository listing"""
+    return f'repos:err:{user_id}:{path}'
+
+
+def _recent_upstream_error(user_id):
+    """Replay a listing failure from the last few seconds instead of hitting upstream again"""
+    error = get_redis().get(repos_error_key(user_id, request.path))
+    if error:
+        return jsonify({'error': error.decode(), 'cached': True}), 500
+    return None
+
+
+def _upstream_error(user_id, error):
+    """Remember a listing failure briefly so repeated clicks coalesce, and report it"""
+    get_redis().setex(repos_error_key(user_id, request.path), UPSTREAM_ERROR_TTL, str(error))
+    return jsonify({'error': str(error)}), 500
+
+
+def _is_ok(rv):
+    """Only cache successful listings"""
+    return rv[1] == 200
 
 
 @bp.route('/github', methods=['GET'])
+@cache.cached(make_cache_key=_listing_cache_key, response_filter=_is_ok)
 def list_github_repos():
     """List user's GitHub repositories"""
     user = get_current_user()
-    if not user or not user.github_token:
+    if not user or not user.github_connected:
         return jsonify({'error': 'Not authenticated with GitHub'}), 401
     
+    cached_error = _recent_upstream_error(user.id)
+    if cached_error:
+        return cached_error
+    
     try:
-        github_service = GitHubService(user.github_token)
+        github_service = GitHubService(get_user_tokens(user.id).github_token)
         repos = github_service.list_repositories()
         return jsonify({'repositories': repos}), 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return _upstream_error(user.id, e)
 
 
 @bp.route('/bitbucket', methods=['GET'])
+@cache.cached(make_cache_key=_listing_cache_key, response_filter=_is_ok)
 def list_bitbucket_repos():
     """List user's Bitbucket repositories"""
     user = get_current_user()
-    if not user or not user.bitbucket_token:
+    if not user or not user.bitbucket_connected:
         return jsonify({'error': 'Not authenticated with Bitbucket'}), 401
     
+    cached_error = _recent_upstream_error(user.id)
+    if cached_error:
+        return cached_error
+    
     try:
-        bitbucket_service = BitbucketService(user.bitbucket_token)
+        bitbucket_service = BitbucketService(get_user_tokens(user.id).bitbucket_token)
         repos = bitbucket_service.list_repositories()
         return jsonify({'repositories': repos}), 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return _upstream_error(user.id, e)
 
 
 @bp.route('/migrate', methods=['POST'])
@@ -51,63 +139,112 @@ def migrate_repository():
     if not user:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    if not user.github_token or not user.bitbucket_token:
+    if not user.github_connected or not user.bitbucket_connected:
         return jsonify({'error': 'Both GitHub and Bitbucket must be connected'}), 400
     
-    data = request.json
-    repo_name = data.get('repo_name')
-    source = data.get('source', 'github')
-    workspace = data.get('workspace')
-    
-    if not repo_name:
-        return jsonify({'error': 'repo_name is required'}), 400
+    try:
+        payload = decode_json(_MIGRATE_DECODER)
+    except msgspec.DecodeError as e:
+        return jsonify({'error': str(e)}), 400
+    repo_name = payload.repo_name
+    source = payload.source
+    workspace = payload.workspace
     
     try:
-        github_service = GitHubService(user.github_token)
-        bitbucket_service = BitbucketService(user.bitbucket_token)
+        tokens = get_user_tokens(user.id)
+        github_service = GitHubService(tokens.github_token)
+        bitbucket_service = BitbucketService(tokens.bitbucket_token)
         
         if source == 'github':
             # Get GitHub repo details
             github_repo = github_service.get_repository(repo_name)
             
-            # Create repository in Bitbucket
-            bitbucket_repo = bitbucket_service.create_repository(
-                repo_name=github_repo['name'],
-                description=github_repo.get('description', ''),
-                is_private=github_repo.get('private', False),
-                workspace=workspace
-            )
-            
-            # Clone and push (in background task ideally)
-            clone_url = github_repo['clone_url']
-            bitbucket_service.mirror_repository(clone_url, bitbucket_repo['links']['clone'][1]['href'])
+            # Databases from before uq_repositories_user_source_repo may hold duplicates
+            # (create_all never adds it to an existing table); resume the newest
+            repository = db.session.execute(
+                select(Repository).filter_by(
+                    user_id=user.id, source='github', source_repo_id=str(github_repo['id'])
+                ).order_by(Repository.id.desc()).limit(1)
+            ).scalar_one_or_none()
             
-            # Save to database
-            repository = Repository(
-                user_id=user.id,
-                name=repo_name,
-                source='github',
-                source_repo_id=github_repo['id'],
-                source_repo_url=github_repo['html_url'],
-                bitbucket_repo_id=bitbucket_repo['uuid'],
-                bitbucket_repo_url=bitbucket_repo['links']['html']['href'],
-                bitbucket_workspace=workspace or bitbucket_repo['workspace']['slug'],
-                status='migrated'
+            stale = (
+                repository is not None and repository.status == 'pending'
+                and repository.updated_at < datetime.utcnow() - MIRROR_STALE_AFTER
             )
-            db.session.add(repository)
+            if repository and repository.status != 'failed' and not stale:
+                # Already mirrored or still mirroring; nothing to redo
+                if repository.status == 'pending':
+                    message = 'Repository migration in progress'
+                else:
+                    message = 'Repository already migrated'
+                return jsonify({
+                    'message': message,
+                    'repository': {
+                        'id': repository.id,
+                        'name': repository.name,
+                        'bitbucket_url': repository.bitbucket_repo_url,
+                        'status': repository.status
+                    }
+                }), 200
+            
+            if repository:
+                # A previous mirror failed or stalled; resume with the Bitbucket repo it already created
+                bitbucket_repo = bitbucket_service.get_repository(repository.bitbucket_workspace, repository.name)
+                repository.status = 'pending'
+            else:
+                # Create repository in Bitbucket
+                bitbucket_repo = bitbucket_service.create_repository(
+                    repo_name=github_repo['name'],
+                    description=github_repo.get('description', ''),
+                    is_private=github_repo.get('private', False),
+                    workspace=workspace
+                )
+                
+                # Save to database
+                repository = Repository(
+                    user_id=user.id,
+                    name=repo_name,
+                    source='github',
+                    source_repo_id=str(github_repo['id']),
+                    source_repo_url=github_repo['html_url'],
+                    bitbucket_repo_id=bitbucket_repo['uuid'],
+                    bitbucket_repo_url=bitbucket_repo['links']['html']['href'],
+                    bitbucket_workspace=workspace or bitbucket_repo['workspace']['slug'],
+                    status='pending'
+                )
+                db.session.add(repository)
             db.session.commit()
+            cache.delete(repos_cache_key(user.id, url_for('.list_bitbucket_repos')))
+            
+            # Clone and push in a worker; it moves the status to migrated/failed
+            try:
+                mirror_repository.delay(
+                    repository.id,
+                    github_repo['clone_url'],
+                    bitbucket_repo['links']['clone'][1]['href']
+                )
+            except Exception:
+                # Nothing will ever finish this mirror; mark it failed so a retry can resume it
+                Repository.query.filter_by(id=repository.id).update({'status': 'failed'}, synchronize_session=False)
+                db.session.commit()
+                raise
             
             return jsonify({
-                'message': 'Repository migrated successfully',
+                'message': 'Repository migration started',
                 'repository': {
                     'id': repository.id,
                     'name': repository.name,
-                    'bitbucket_url': repository.bitbucket_repo_url
+                    'bitbucket_url': repository.bitbucket_repo_url,
+                    'status': repository.status
                 }
-            }), 201
+            }), 202
         else:
             return jsonify({'error': 'Only GitHub to Bitbucket migration is supported'}), 400
             
+    except IntegrityError:
+        # A concurrent request registered the same upstream repository first
+        db.session.rollback()
+        return jsonify({'error': 'Repository migration already started'}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -120,19 +257,37 @@ def list_repositories():
     if not user:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    repositories = Repository.query.filter_by(user_id=user.id).all()
+    # Project only the listed columns, most recently updated first
+    query = db.session.query(
+        Repository.id, Repository.name, Repository.source,
+        Repository.source_repo_url.label('source_url'),
+        Repository.bitbucket_repo_url.label('bitbucket_url'),
+        Repository.status, Repository.created_at, Repository.updated_at
+    ).filter_by(user_id=user.id).order_by(Repository.updated_at.desc(), Repository.id.desc())
+    
+    # Optional keyset pagination: ?limit=N&cursor=<next_cursor from the previous page>
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            updated_at, last_id = _decode_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(tuple_(Repository.updated_at, Repository.id) < (updated_at, last_id))
+    
+    limit = request.args.get('limit', type=int)
+    next_cursor = None
+    if limit:
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        repositories = query.limit(limit + 1).all()
+        if len(repositories) > limit:
+            repositories = repositories[:limit]
+            next_cursor = _encode_cursor(repositories[-1])
+    else:
+        repositories = query.all()
     
     return jsonify({
-        'repositories': [{
-            'id': repo.id,
-            'name': repo.name,
-            'source': repo.source,
-            'source_url': repo.source_repo_url,
-            'bitbucket_url': repo.bitbucket_repo_url,
-            'status': repo.status,
-            'created_at': repo.created_at.isoformat() if repo.created_at else None,
-            'updated_at': repo.updated_at.isoformat() if repo.updated_at else None
-        } for repo in repositories]
+        'next_cursor': next_cursor,
+        'repositories': [repo._asdict() for repo in repositories]
     }), 200
 
 
@@ -143,11 +298,15 @@ def get_repository(repo_id):
     if not user:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    repository = Repository.query.filter_by(id=repo_id, user_id=user.id).first()
+    repository = get_owned_repository(repo_id, user.id)
     if not repository:
         return jsonify({'error': 'Repository not found'}), 404
     
-    return jsonify({
+    etag = make_etag(repository.id, repository.updated_at)
+    if client_has(etag):
+        return not_modified(etag)
+    
+    response = jsonify({
         'id': repository.id,
         'name': repository.name,
         'source': repository.source,
@@ -155,9 +314,24 @@ def get_repository(repo_id):
         'bitbucket_url': repository.bitbucket_repo_url,
         'bitbucket_workspace': repository.bitbucket_workspace,
         'status': repository.status,
-        'created_at': repository.created_at.isoformat() if repository.created_at else None,
-        'updated_at': repository.updated_at.isoformat() if repository.updated_at else None
-    }), 200
+        'created_at': repository.created_at,
+        'updated_at': repository.updated_at
+    })
+    return with_etag(response, etag), 200
+
+
+@bp.route('/<int:repo_id>/status', methods=['GET'])
+def get_repository_status(repo_id):
+    """Get repository migration status"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    status = db.session.query(Repository.status).filter_by(id=repo_id, user_id=user.id).scalar()
+    if status is None:
+        return jsonify({'error': 'Repository not found'}), 404
+    
+    return jsonify({'id': repo_id, 'status': status}), 200
 
 
 @bp.route('/<int:repo_id>', methods=['DELETE'])
@@ -167,7 +341,7 @@ def delete_repository(repo_id):
     if not user:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    repository = Repository.query.filter_by(id=repo_id, user_id=user.id).first()
+    repository = get_owned_repository(repo_id, user.id)
     if not repository:
         return jsonify({'error': 'Repository not found'}), 404
     
@@ -1,15 +1,27 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, jsonify, session
+from typing import Annotated
+import msgspec
 from ..models import User, db
+from ..utils.request_body import decode_json
+from ..utils.user_cache import invalidate_user
 
 bp = Blueprint('settings', __name__)
 
 
+class GeminiKeyPayload(msgspec.Struct):
+    """Request body for setting the Gemini API key"""
+    api_key: Annotated[str, msgspec.Meta(min_length=1)]
+
+
+_GEMINI_KEY_DECODER = msgspec.json.Decoder(GeminiKeyPayload, strict=False)
+
+
 def get_current_user():
     """Get current authenticated user"""
     user_id = session.get('user_id')
     if not user_id:
         return None
-    return User.query.get(user_id)
+    return db.session.get(User, user_id)
 
 
 @bp.route('/', methods=['GET'])
@@ -33,15 +45,15 @@ def update_gemini_api_key():
     if not user:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    data = request.json
-    api_key = data.get('api_key')
-    
-    if not api_key:
-        return jsonify({'error': 'api_key is required'}), 400
+    try:
+        api_key = decode_json(_GEMINI_KEY_DECODER).api_key
+    except msgspec.DecodeError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
         user.gemini_api_key = api_key
         db.session.commit()
+        invalidate_user(user.id)
         
         return jsonify({'message': 'Gemini API key updated successfully'}), 200
     except Exception as e:
@@ -59,6 +71,7 @@ def delete_gemini_api_key():
     try:
         user.gemini_api_key = None
         db.session.commit()
+        invalidate_user(user.id)
         
         return jsonify({'message': 'Gemini API key removed successfully'}), 200
     except Exception as e:
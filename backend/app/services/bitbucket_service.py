@@ -1,9 +1,57 @@
-import requests
-import base64
+import orjson
 import subprocess
 import tempfile
+import threading
+import time
 import os
-import shutil
+from ..utils.http_session import pooled_session
+
+
+# Shared session so all Bitbucket API calls reuse keep-alive connections
+_BB_SESSION = pooled_session('https://api.bitbucket.org')
+
+# Partial-response field set for list_repositories
+_REPOSITORY_LIST_FIELDS = ','.join([
+    'next', 'values.uuid', 'values.name', 'values.slug', 'values.description',
+    'values.is_private', 'values.links.html.href', 'values.workspace.slug'
+])
+
+# Where mirror clones are staged; point at a tmpfs mount to keep them in RAM
+MIRROR_TMPDIR = os.getenv('MIRROR_TMPDIR') or None
+
+# Short-lived cache for GETs of metadata that rarely changes (workspaces, repository
+# details). Keys include the access token, so one user's answer never serves another
+METADATA_TTL = 300
+METADATA_CACHE_SIZE = 1024
+_METADATA = {}
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def _cached_metadata(key, load):
+    """Return a fresh cached value for key, or load and cache it"""
+    cached = _METADATA.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
+    # Concurrent misses for one key share a single upstream call: the first thread
+    # loads while the rest wait on its lock and then find the value cached
+    with _INFLIGHT_LOCK:
+        lock = _INFLIGHT.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            cached = _METADATA.get(key)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            
+            value = load()
+            if len(_METADATA) >= METADATA_CACHE_SIZE:
+                _METADATA.clear()
+            _METADATA[key] = (time.monotonic() + METADATA_TTL, value)
+            return value
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(key, None)
 
 
 class BitbucketService:
@@ -12,24 +60,31 @@ class BitbucketService:
     def __init__(self, access_token):
         self.access_token = access_token
         self.base_url = 'https://api.bitbucket.org/2.0'
-        self.headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
+        self.auth_headers = {'Authorization': f'Bearer {access_token}'}
+        self.headers = {**self.auth_headers, 'Content-Type': 'application/json'}
+    
+    def _request_json(self, method, url, payload=None, **kwargs):
+        """Send an API request on the shared session, encoding and decoding JSON with orjson"""
+        if payload is not None:
+            kwargs['data'] = orjson.dumps(payload)
+        response = _BB_SESSION.request(method, url, headers=self.headers, **kwargs)
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    
+    def _get_cached_json(self, url):
+        """GET slow-changing metadata through the short-lived per-token cache"""
+        return _cached_metadata((self.access_token, url), lambda: self._request_json('GET', url))
     
     def list_repositories(self):
         """List user's repositories"""
         url = f'{self.base_url}/repositories'
-        params = {'role': 'member'}
-        
-        response = requests.get(url, headers=self.headers, params=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        # Largest page Bitbucket allows, trimmed to the fields we return
+        params = {'role': 'member', 'pagelen': 100, 'fields': _REPOSITORY_LIST_FIELDS}
         repos = []
         
-        for repo in data.get('values', []):
-            repos.append({
+        while url:
+            data = self._request_json('GET', url, params=params)
+            repos.extend({
                 'uuid': repo['uuid'],
                 'name': repo['name'],
                 'slug': repo['slug'],
@@ -37,18 +92,19 @@ class BitbucketService:
                 'is_private': repo['is_private'],
                 'html_url': repo['links']['html']['href'],
                 'workspace': repo['workspace']['slug']
-            })
+            } for repo in data.get('values', []))
+            
+            # The next link already carries the query string
+            url = data.get('next')
+            params = None
         
         return repos
     
     def get_workspaces(self):
-        """Get user's workspaces"""
+        """Get user's workspaces, cached briefly per token"""
         url = f'{self.base_url}/workspaces'
         
-        response = requests.get(url, headers=self.headers)
-        response.raise_for_status()
-        
-        data = response.json()
+        data = self._get_cached_json(url)
         return [
             {
                 'slug': ws['slug'],
@@ -74,26 +130,41 @@ class BitbucketService:
             'description': description
         }
         
-        response = requests.post(url, json=payload, headers=self.headers)
-        response.raise_for_status()
+        return self._request_json('POST', url, payload)
+    
+    def get_repository(self, workspace, repo_slug):
+        """Get an existing repository in Bitbucket"""
+        url = f'{self.base_url}/repositories/{workspace}/{repo_slug}'
         
-        return response.json()
+        return self._request_json('GET', url)
+    
+    def get_default_branch(self, workspace, repo_slug):
+        """Get a repository's main branch name, cached briefly per token"""
+        url = f'{self.base_url}/repositories/{workspace}/{repo_slug}'
+        mainbranch = self._get_cached_json(url).get('mainbranch')
+        if not mainbranch:
+            # Repositories have no main branch until the mirror push lands; drop the
+            # cached document so the next attempt sees the branch once it exists
+            _METADATA.pop((self.access_token, url), None)
+            raise Exception(f'Repository {workspace}/{repo_slug} has no main branch yet')
+        return mainbranch['name']
     
     def mirror_repository(self, source_url, destination_url):
         """Mirror a repository from source to destination"""
-        # This is a simplified version - in production, use background tasks
-        with tempfile.TemporaryDirectory() as tmpdir:
+        # Runs in a Celery worker (see tasks.mirror_repository)
+        with tempfile.TemporaryDirectory(dir=MIRROR_TMPDIR) as tmpdir:
             try:
-                # Clone source repository
+                # Clone every ref in one fetch; no working tree, no progress output.
+                # A blob-filtered partial clone would not help: push --mirror needs every object
                 subprocess.run(
-                    ['git', 'clone', '--bare', source_url, tmpdir],
+                    ['git', 'clone', '--mirror', '--quiet', source_url, tmpdir],
                     check=True,
                     capture_output=True
                 )
                 
                 # Push to destination
                 subprocess.run(
-                    ['git', '--git-dir', tmpdir, 'push', '--mirror', destination_url],
+                    ['git', '--git-dir', tmpdir, 'push', '--mirror', '--quiet', destination_url],
                     check=True,
                     capture_output=True
                 )
@@ -107,11 +178,7 @@ class BitbucketService:
         # First, create a new branch
         branch_url = f'{self.base_url}/repositories/{workspace}/{repo_slug}/refs/branches'
         
-        # Get default branch
-        repo_url = f'{self.base_url}/repositories/{workspace}/{repo_slug}'
-        repo_response = requests.get(repo_url, headers=self.headers)
-        repo_response.raise_for_status()
-        default_branch = repo_response.json()['mainbranch']['name']
+        default_branch = self.get_default_branch(workspace, repo_slug)
         
         # Create branch
         branch_payload = {
@@ -120,7 +187,7 @@ class BitbucketService:
                 'hash': default_branch
             }
         }
-        branch_response = requests.post(branch_url, json=branch_payload, headers=self.headers)
+        branch_response = _BB_SESSION.post(branch_url, data=orjson.dumps(branch_payload), headers=self.headers)
         # Branch might already exist, which is okay
         
         # Commit pipeline file
@@ -132,9 +199,7 @@ class BitbucketService:
             'branch': branch_name
         }
         
-        commit_response = requests.post(file_url, data=files, headers={
-            'Authorization': f'Bearer {self.access_token}'
-        })
+        commit_response = _BB_SESSION.post(file_url, data=files, headers=self.auth_headers)
         commit_response.raise_for_status()
         
         # Create pull request
@@ -155,7 +220,6 @@ class BitbucketService:
             }
         }
         
-        pr_response = requests.post(pr_url, json=pr_payload, headers=self.headers)
-        pr_response.raise_for_status()
+        pr = self._request_json('POST', pr_url, pr_payload)
         
-        return pr_response.json()['links']['html']['href']
+        return pr['links']['html']['href']
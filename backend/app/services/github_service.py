@@ -1,5 +1,37 @@
 from github import Github
-import requests
+from ..utils.http_session import pooled_session
+
+GRAPHQL_URL = 'https://api.github.com/graphql'
+
+# Same affiliations the REST /user/repos listing returns by default
+_LIST_REPOSITORIES_QUERY = """
+query($cursor: String) {
+  viewer {
+    repositories(
+      first: 100
+      after: $cursor
+      affiliations: [OWNER, COLLABORATOR, ORGANIZATION_MEMBER]
+      ownerAffiliations: [OWNER, COLLABORATOR, ORGANIZATION_MEMBER]
+    ) {
+      nodes {
+        databaseId
+        name
+        nameWithOwner
+        description
+        isPrivate
+        url
+        defaultBranchRef { name }
+        primaryLanguage { name }
+      }
+      pageInfo { hasNextPage endCursor }
+    }
+  }
+}
+"""
+
+# Shared session so paginated GraphQL calls reuse keep-alive connections;
+# queries are POSTs, which the retry policy does not replay
+_GH_SESSION = pooled_session('https://api.github.com')
 
 
 class GitHubService:
@@ -11,21 +43,41 @@ class GitHubService:
     
     def list_repositories(self):
         """List user's repositories"""
-        user = self.github.get_user()
         repos = []
+        cursor = None
         
-        for repo in user.get_repos():
-            repos.append({
-                'id': repo.id,
-                'name': repo.name,
-                'full_name': repo.full_name,
-                'description': repo.description,
-                'private': repo.private,
-                'html_url': repo.html_url,
-                'clone_url': repo.clone_url,
-                'default_branch': repo.default_branch,
-                'language': repo.language
-            })
+        # GraphQL returns 100 repositories with just these fields per round-trip
+        while True:
+            response = _GH_SESSION.post(
+                GRAPHQL_URL,
+                headers={'Authorization': f'Bearer {self.access_token}'},
+                json={'query': _LIST_REPOSITORIES_QUERY, 'variables': {'cursor': cursor}}
+            )
+            response.raise_for_status()
+            
+            data = response.json()
+            # Repositories GraphQL cannot resolve (e.g. SAML-protected orgs) come back
+            # as null nodes alongside errors; only fail when there is no data at all
+            if not data.get('data'):
+                errors = data.get('errors') or [{'message': 'GitHub returned no data'}]
+                raise Exception(errors[0]['message'])
+            
+            page = data['data']['viewer']['repositories']
+            repos.extend({
+                'id': repo['databaseId'],
+                'name': repo['name'],
+                'full_name': repo['nameWithOwner'],
+                'description': repo['description'],
+                'private': repo['isPrivate'],
+                'html_url': repo['url'],
+                'clone_url': f"{repo['url']}.git",
+                'default_branch': (repo['defaultBranchRef'] or {}).get('name'),
+                'language': (repo['primaryLanguage'] or {}).get('name')
+            } for repo in page['nodes'] if repo)
+            
+            if not page['pageInfo']['hasNextPage']:
+                break
+            cursor = page['pageInfo']['endCursor']
         
         return repos
     
@@ -63,3 +115,4 @@ class GitHubService:
             ]
         except Exception:
             return []
+
@@ -2,7 +2,6 @@ import docker
 import tempfile
 import os
 import yaml
-import shutil
 import subprocess
 
 
@@ -0,0 +1,109 @@
+from celery import shared_task
+from sqlalchemy.orm import joinedload, undefer_group
+import orjson
+from .models import Pipeline, Repository, db
+from .services.bitbucket_service import BitbucketService
+from .utils.redis_client import get_redis
+
+# Keep PR progress around long enough for clients to reconnect
+PR_EVENTS_TTL = 3600
+
+# PR tasks get their own queue and worker so long mirrors cannot hold them up
+PR_QUEUE = 'pr'
+
+# The per-pipeline PR lock doubles as the task's liveness key. It covers the wait in
+# PR_QUEUE plus the Bitbucket calls (retried GETs may sleep up to 3 x 30s on
+# Retry-After); the worker renews it on start and tasks still queued past it expire
+PR_LOCK_SECONDS = 300
+
+
+def pr_channel(pipeline_id):
+    """Redis pub/sub channel carrying PR progress for a pipeline"""
+    return f'pr:{pipeline_id}'
+
+
+def pr_lock_key(pipeline_id):
+    """Redis key guarding a single in-flight PR creation per pipeline"""
+    return f'pr:lock:{pipeline_id}'
+
+
+def pr_events_key(pipeline_id):
+    """Redis list holding PR progress already published for a pipeline"""
+    return f'pr:{pipeline_id}:events'
+
+
+def publish_pr_event(pipeline_id, status, **data):
+    """Record a PR progress event and notify stream subscribers"""
+    redis_client = get_redis()
+    event = {'status': status, **data}
+    
+    # The event's position in the list doubles as its SSE id
+    event['id'] = redis_client.rpush(pr_events_key(pipeline_id), orjson.dumps(event))
+    redis_client.expire(pr_events_key(pipeline_id), PR_EVENTS_TTL)
+    redis_client.publish(pr_channel(pipeline_id), orjson.dumps(event))
+
+
+@shared_task(ignore_result=True, queue=PR_QUEUE)
+def create_pipeline_pr(pipeline_id):
+    """Create the Bitbucket pull request for a pipeline that has been claimed"""
+    # A lapsed lock means streams have already reported failure; don't act on the claim
+    if not get_redis().expire(pr_lock_key(pipeline_id), PR_LOCK_SECONDS):
+        return
+    
+    pipeline = Pipeline.query.options(
+        joinedload(Pipeline.repository).joinedload(Repository.user), undefer_group('content')
+    ).filter_by(id=pipeline_id).first()
+    if not pipeline:
+        # Still end any open progress stream
+        publish_pr_event(pipeline_id, 'failed', error='Pipeline not found')
+        get_redis().delete(pr_lock_key(pipeline_id))
+        return
+    
+    publish_pr_event(pipeline_id, 'started')
+    
+    try:
+        # Read the token here so it never travels through the broker
+        bitbucket_service = BitbucketService(pipeline.repository.user.bitbucket_token)
+        
+        # Create branch and commit pipeline configuration
+        pr_url = bitbucket_service.create_pipeline_pr(
+            workspace=pipeline.repository.bitbucket_workspace,
+            repo_slug=pipeline.repository.name,
+            pipeline_config=pipeline.config,
+            branch_name=f'add-pipeline-v{pipeline.version}'
+        )
+        
+        Pipeline.query.filter_by(id=pipeline_id).update({'pr_url': pr_url}, synchronize_session=False)
+        db.session.commit()
+        
+        publish_pr_event(pipeline_id, 'completed', pr_url=pr_url)
+        
+    except Exception as e:
+        db.session.rollback()
+        # Release the claim so the PR can be retried
+        Pipeline.query.filter_by(id=pipeline_id).update({'pr_created': False}, synchronize_session=False)
+        db.session.commit()
+        
+        publish_pr_event(pipeline_id, 'failed', error=str(e))
+    
+    finally:
+        get_redis().delete(pr_lock_key(pipeline_id))
+
+
+@shared_task(bind=True, max_retries=3, ignore_result=True)
+def mirror_repository(self, repository_id, source_url, destination_url):
+    """Mirror a source repository into its newly created Bitbucket repository"""
+    repository = Repository.query.options(joinedload(Repository.user)).filter_by(id=repository_id).first()
+    if not repository:
+        return
+    
+    try:
+        BitbucketService(repository.user.bitbucket_token).mirror_repository(source_url, destination_url)
+        status = 'migrated'
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=30)
+        status = 'failed'
+    
+    Repository.query.filter_by(id=repository_id).update({'status': status}, synchronize_session=False)
+    db.session.commit()
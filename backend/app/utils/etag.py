@@ -0,0 +1,27 @@
+from flask import current_app, request
+import hashlib
+
+
+def make_etag(*parts):
+    """Derive an ETag from the values that determine a response body"""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def client_has(etag):
+    """Whether If-None-Match names this ETag, with or without Flask-Compress's ':br'/':gzip' suffix"""
+    tags = request.if_none_match
+    return tags.star_tag or any(
+        tag.split(':', 1)[0] == etag for tag in tags.as_set(include_weak=True)
+    )
+
+
+def with_etag(response, etag):
+    """Tag a per-user response so the browser revalidates it on every request"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag):
+    """Empty 304 response for a client that already has the current body"""
+    return with_etag(current_app.response_class(status=304), etag)
@@ -0,0 +1,33 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Longest a request thread will honour a Retry-After before trying again
+RETRY_AFTER_CAP = 30
+
+
+class CappedRetry(Retry):
+    """Retry that honours Retry-After on 429/503 but never sleeps past RETRY_AFTER_CAP"""
+    
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, RETRY_AFTER_CAP)
+
+
+def pooled_session(prefix):
+    """Session with a keep-alive pool and backoff retries for one API host"""
+    # Idempotent requests retry on rate limiting and gateway errors; once retries
+    # run out the last response is returned so raise_for_status() still reports it
+    retry = CappedRetry(
+        total=3,
+        backoff_factor=0.5,
+        backoff_max=RETRY_AFTER_CAP,
+        backoff_jitter=0.5,
+        status_forcelist=(429, 502, 503, 504),
+        raise_on_status=False
+    )
+    session = requests.Session()
+    session.mount(prefix, HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=retry))
+    return session
@@ -0,0 +1,28 @@
+from flask.json.provider import DefaultJSONProvider
+import orjson
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes and decodes with orjson"""
+    
+    # Naive datetimes in the models are UTC (datetime.utcnow)
+    option = orjson.OPT_NAIVE_UTC
+    
+    def dumps(self, obj, **kwargs):
+        # Callers passing stdlib options (e.g. the session serializer) keep the stdlib path
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+    
+    def loads(self, s, **kwargs):
+        # orjson has no object_hook, which the session serializer relies on
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype=self.mimetype
+        )
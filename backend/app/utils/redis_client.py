@@ -0,0 +1,12 @@
+from flask import current_app
+import redis
+
+
+def init_redis(app):
+    """Create the shared Redis client (connections are opened lazily)"""
+    app.extensions['redis'] = redis.Redis.from_url(app.config['REDIS_URL'])
+
+
+def get_redis():
+    """Get the Redis client for the current app"""
+    return current_app.extensions['redis']
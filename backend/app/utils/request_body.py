@@ -0,0 +1,6 @@
+from flask import request
+
+
+def decode_json(decoder):
+    """Decode and validate the JSON request body with a precompiled msgspec decoder"""
+    return decoder.decode(request.get_data(cache=False) or b'{}')
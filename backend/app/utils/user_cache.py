@@ -0,0 +1,77 @@
+from flask import g, session
+from typing import Optional
+import msgspec
+from ..models import User, db
+from .redis_client import get_redis
+
+USER_CACHE_SECONDS = 300
+
+
+class CachedUser(msgspec.Struct):
+    """Read-only snapshot of the user fields routes need on every request"""
+    # Identity and connection flags only: credentials stay in the database (see
+    # get_user_tokens) so they never land in Redis beside broker and session data
+    id: int
+    email: str
+    bitbucket_username: Optional[str] = None
+    github_username: Optional[str] = None
+    bitbucket_connected: bool = False
+    github_connected: bool = False
+    gemini_configured: bool = False
+
+
+_ENCODER = msgspec.json.Encoder()
+_DECODER = msgspec.json.Decoder(CachedUser)
+
+
+def user_cache_key(user_id):
+    """Redis key for a user's cached snapshot"""
+    return f'user:{user_id}:profile'
+
+
+def get_cached_user(user_id):
+    """Load a user snapshot from Redis, falling back to the database on a miss"""
+    redis_client = get_redis()
+    cached = redis_client.get(user_cache_key(user_id))
+    if cached:
+        return _DECODER.decode(cached)
+    
+    row = db.session.query(
+        User.id, User.email, User.bitbucket_username, User.github_username,
+        User.bitbucket_token, User.github_token, User.gemini_api_key
+    ).filter_by(id=user_id).first()
+    if not row:
+        return None
+    
+    user = CachedUser(
+        id=row.id,
+        email=row.email,
+        bitbucket_username=row.bitbucket_username,
+        github_username=row.github_username,
+        bitbucket_connected=bool(row.bitbucket_token),
+        github_connected=bool(row.github_token),
+        gemini_configured=bool(row.gemini_api_key)
+    )
+    redis_client.setex(user_cache_key(user_id), USER_CACHE_SECONDS, _ENCODER.encode(user))
+    return user
+
+
+def get_user_tokens(user_id):
+    """Read a user's upstream credentials straight from the database"""
+    return db.session.query(
+        User.bitbucket_token, User.github_token, User.gemini_api_key
+    ).filter_by(id=user_id).first()
+
+
+def get_current_user():
+    """Get the authenticated user's snapshot, loaded at most once per request"""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = get_cached_user(user_id) if user_id else None
+    return g.current_user
+
+
+def invalidate_user(user_id):
+    """Drop the cached snapshot after the user row changes"""
+    get_redis().delete(user_cache_key(user_id))
+    g.pop('current_user', None)
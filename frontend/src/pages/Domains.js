@@ -35,7 +35,7 @@ function Domains() {
     setSuccess('');
 
     try {
-      await domainsAPI.create(formData);
+      await domainsAPI.create({ ...formData, parent_domain_id: formData.parent_domain_id || null });
       setSuccess('Domain created successfully!');
       setFormData({ name: '', is_root: false, parent_domain_id: '', description: '' });
       setShowForm(false);
@@ -99,14 +99,36 @@ function Pipelines() {
     setSuccess('');
 
     try {
-      const response = await pipelinesAPI.createPR({ pipeline_id: pipelineId });
-      setSuccess(`Pull request created! ${response.data.pr_url}`);
-      loadPipelines();
+      await pipelinesAPI.createPR({ pipeline_id: pipelineId });
     } catch (error) {
       setError(error.response?.data?.error || 'Failed to create pull request');
-    } finally {
       setLoading(false);
+      return;
     }
+
+    // PR creation runs in the background; follow its progress over SSE
+    const events = pipelinesAPI.streamPR(pipelineId);
+    events.onmessage = (message) => {
+      const event = JSON.parse(message.data);
+      if (event.status === 'completed') {
+        setSuccess(`Pull request created! ${event.pr_url}`);
+      } else if (event.status === 'failed') {
+        setError(event.error || 'Failed to create pull request');
+      } else {
+        return;
+      }
+      events.close();
+      setLoading(false);
+      loadPipelines();
+    };
+    events.onerror = () => {
+      // The browser reconnects on its own unless the stream was rejected
+      if (events.readyState === EventSource.CLOSED) {
+        setError('Lost track of pull request progress');
+        setLoading(false);
+        loadPipelines();
+      }
+    };
   };
 
   const loadPipelineDetails = async (pipelineId) => {
@@ -176,7 +198,7 @@ function Pipelines() {
                     <br />
                     <small>
                       Status: <span className={`status-badge status-${pipeline.status}`}>{pipeline.status}</span>
-                      {pipeline.pr_created && (
+                      {pipeline.pr_url && (
                         <span> | <a href={pipeline.pr_url} target="_blank" rel="noopener noreferrer">View PR →</a></span>
                       )}
                     </small>
@@ -206,7 +228,7 @@ function Pipelines() {
                         Fix with AI
                       </button>
                     )}
-                    {pipeline.status === 'success' && !pipeline.pr_created && (
+                    {pipeline.status === 'success' && !pipeline.pr_url && (
                       <button 
                         className="button button-success"
                         onClick={() => handleCreatePR(pipeline.id)}
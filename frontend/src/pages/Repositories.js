@@ -61,7 +61,7 @@ function Repositories() {
         source: 'github',
         deployment_server: deploymentServer
       });
-      setSuccess('Repository migrated successfully!');
+      setSuccess('Repository migration started!');
       setSelectedRepo('');
       setDeploymentServer('');
       loadRepositories();
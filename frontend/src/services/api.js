@@ -35,6 +35,7 @@ export const pipelinesAPI = {
   test: (data) => apiClient.post('/api/pipelines/test', data),
   iterate: (data) => apiClient.post('/api/pipelines/iterate', data),
   createPR: (data) => apiClient.post('/api/pipelines/create-pr', data),
+  streamPR: (id) => new EventSource(`${API_BASE_URL}/api/pipelines/${id}/pr/stream`, { withCredentials: true }),
   list: (repoId) => apiClient.get(`/api/pipelines/repository/${repoId}`),
   get: (id) => apiClient.get(`/api/pipelines/${id}`),
 };